@@ -2,6 +2,7 @@
 FastAPI endpoints for the RCAccelerator API.
 """
 import asyncio
+from contextlib import asynccontextmanager
 from typing import Dict, Any, List
 import re
 import httpx
@@ -14,9 +15,23 @@ from chat import handle_user_message_api
 from config import config
 from settings import ModelSettings
 from generation import discover_generative_model_names
-from embeddings import discover_embeddings_model_names
+from embeddings import (
+    discover_embeddings_model_names, is_known_embeddings_model, close_http_client
+)
+from vectordb import get_vector_store, close_vector_store
 
-app = FastAPI(title="RCAccelerator API")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Connect to the vector database on startup and release the resources
+    shared by the requests on shutdown."""
+    await asyncio.to_thread(get_vector_store)
+    yield
+    await close_http_client()
+    await close_vector_store()
+
+
+app = FastAPI(title="RCAccelerator API", lifespan=lifespan)
 
 class BaseModelSettings(BaseModel):
     """Base model with common settings for model configuration."""
@@ -54,13 +69,13 @@ async def validate_settings(request: BaseModelSettings) -> BaseModelSettings:
             detail=f"Invalid generative model. Available: {available_generative_models}"
         )
 
-    available_embedding_models = await discover_embeddings_model_names()
     if not request.embeddings_model_name:
-        request.embeddings_model_name = available_embedding_models[0]
-    elif request.embeddings_model_name not in available_embedding_models:
+        request.embeddings_model_name = (await discover_embeddings_model_names())[0]
+    elif not await is_known_embeddings_model(request.embeddings_model_name):
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid embeddings model. Available: {available_embedding_models}"
+            detail="Invalid embeddings model. Available: "
+                   f"{await discover_embeddings_model_names()}"
         )
 
     if request.profile_name not in [CI_LOGS_PROFILE, DOCS_PROFILE, RCA_FULL_PROFILE]:
@@ -2,6 +2,8 @@
 Chainlit-based chatbot for Root Cause Analysis assistance
 with RAG capabilities.
 """
+import asyncio
+
 import chainlit as cl
 from chainlit.input_widget import Select, Switch, Slider
 
@@ -10,7 +12,8 @@ import constants
 from chat import handle_user_message
 from auth import authentification
 from generation import discover_generative_model_names
-from embeddings import discover_embeddings_model_names
+from embeddings import discover_embeddings_model_names, close_http_client
+from vectordb import get_vector_store, close_vector_store
 
 
 @cl.set_chat_profiles
@@ -180,3 +183,22 @@ async def end_chat():
     ends.
     """
     pass  # pylint: disable=unnecessary-pass
+
+
+@cl.on_app_startup
+async def app_startup():
+    """
+    Handle application startup event.
+    Connect to the vector database before the first chat session needs it.
+    """
+    await asyncio.to_thread(get_vector_store)
+
+
+@cl.on_app_shutdown
+async def app_shutdown():
+    """
+    Handle application shutdown event.
+    Release the resources shared by all chat sessions.
+    """
+    await close_http_client()
+    await close_vector_store()
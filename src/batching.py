@@ -0,0 +1,125 @@
+"""Coalescing of concurrent requests into batched requests."""
+
+from collections.abc import Hashable
+from typing import Any
+import asyncio
+import math
+
+
+class RequestBatcher:
+    """Coalesce concurrent requests into batched requests.
+
+    Requests are queued per key (e.g., a model or a collection) and sent right
+    away in batches of up to max_batch_size items whose total cost (see
+    _item_cost) is at most max_batch_cost, with at most max_concurrent_batches
+    requests in flight per key. An item over max_batch_cost is sent alone.
+    Requests arriving while all slots are busy are sent together once a slot
+    frees up, so concurrent sessions share round-trips without delaying a
+    lone request.
+
+    Subclasses implement _send_batch.
+    """
+
+    def __init__(self, max_batch_size: int, max_concurrent_batches: int,
+                 max_batch_cost: float = math.inf):
+        """Initialize the batcher.
+
+        Args:
+            max_batch_size: The maximum number of items in a single request.
+            max_concurrent_batches: The maximum number of requests in flight
+                for a single key.
+            max_batch_cost: The maximum total cost of the items in a single
+                request.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_batch_cost = max_batch_cost
+        self._pending: dict[Hashable, list[tuple[Any, asyncio.Future]]] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Send the item as part of a batched request and return its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((item, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._run(key))
+        return await future
+
+    @staticmethod
+    def _item_cost(item: Any) -> float:  # pylint: disable=unused-argument
+        """Get the cost of an item, counted against max_batch_cost."""
+        return 0
+
+    def _take_batch(self, pending: list[tuple[Any, asyncio.Future]]) -> list:
+        """Remove the next batch from the queue, it has at least one item."""
+        end = 1
+        cost = self._item_cost(pending[0][0])
+        for item, _ in pending[1:self.max_batch_size]:
+            cost += self._item_cost(item)
+            if cost > self.max_batch_cost:
+                break
+            end += 1
+        batch = pending[:end]
+        del pending[:end]
+        return batch
+
+    async def _send_batch(self, key: Hashable, items: list) -> list:
+        """Send a single batched request.
+
+        Args:
+            key: The key the items were queued under.
+            items: The items of the batch.
+
+        Returns:
+            The results of the items, in the order of the items.
+        """
+        raise NotImplementedError
+
+    async def _run(self, key: Hashable) -> None:
+        """Send the queued requests for the key until the queue is empty."""
+        pending = self._pending[key]
+        in_flight: set[asyncio.Task] = set()
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < self.max_concurrent_batches:
+                    batch = self._take_batch(pending)
+                    # Requests of cancelled callers are not sent at all.
+                    batch = [(item, f) for item, f in batch if not f.done()]
+                    if batch:
+                        in_flight.add(asyncio.create_task(self._send(batch, key)))
+
+                if in_flight:
+                    _, in_flight = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Only reached with queued requests if the worker was cancelled.
+            del self._workers[key]
+            for task in in_flight:
+                task.cancel()
+            for _, future in pending:
+                future.cancel()
+            pending.clear()
+
+    async def _send(
+        self, batch: list[tuple[Any, asyncio.Future]], key: Hashable
+    ) -> None:
+        """Send a single batched request and resolve the futures of the batch."""
+        try:
+            results = await self._send_batch(key, [item for item, _ in batch])
+            # A short result list would leave callers waiting forever.
+            if len(results) != len(batch):
+                raise ValueError(
+                    f"Expected {len(batch)} results, got {len(results)}")
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -1,13 +1,20 @@
 """Handler for chat messages and responses."""
+import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass
+import heapq
+from operator import itemgetter
+import os
+import time
 import chainlit as cl
 from chainlit.context import ChainlitContextException
 import httpx
 from openai.types.chat import ChatCompletionAssistantMessageParam
 
 import constants
-from prompt import build_prompt
-from vectordb import vector_store
+from prompt import build_prompt, format_score
+from vectordb import get_vector_store
+from query_cache import normalize_embedding, query_cache
 from generation import get_response
 from embeddings import (
     get_num_tokens, generate_embedding,
@@ -21,6 +28,16 @@ from constants import (
     TEXT_UPLOAD_TEMPLATE,
     )
 
+# The maximum number of token counts kept by get_num_tokens_cached.
+NUM_TOKENS_CACHE_SIZE = 1024
+_num_tokens_cache: OrderedDict[tuple[str, int], int] = OrderedDict()
+
+# Uploaded files larger than this many bytes per token of the embeddings
+# context are rejected without reading them. Tokens are usually 3-5 bytes, but
+# runs of whitespace in logs and indented code can take many more, so the
+# bound is loose enough not to reject files that would pass the length check.
+MAX_UPLOAD_BYTES_PER_TOKEN = 16
+
 
 # Create mock message and response objects
 @dataclass
@@ -36,7 +53,41 @@ class MockMessage:
     urls: list
 
 
-async def perform_multi_collection_search(
+async def _search_collection(
+    message_content: str,
+    embedding: list[float],
+    similarity_threshold: float,
+    collection: str,
+    enable_rerank: bool,
+) -> list[dict] | None:
+    """Search a single collection and score the results.
+
+    Args:
+         message_content: The content of the user's message.
+         embedding: The embedding of the message content.
+         similarity_threshold: The similarity threshold to use.
+         collection: The collection to search.
+         enable_rerank: Whether to compute the rerank score of the results.
+
+    Returns:
+        The scored results or None if the search failed.
+    """
+    results = await get_vector_store().search(
+        embedding, similarity_threshold, collection)
+    if results is None:
+        return None
+
+    for r in results:
+        r['collection'] = collection
+        if enable_rerank:
+            r['rerank_score'] = await get_rerank_score(message_content, r['text'])
+        else:
+            r['rerank_score'] = None
+
+    return results
+
+
+async def perform_multi_collection_search( # pylint: disable=too-many-locals
     message_content: str,
     embeddings_model_name: str,
     similarity_threshold: float,
@@ -47,7 +98,7 @@ async def perform_multi_collection_search(
 
     The function first queries all the collections from the vector database and
     then sorts them based on the rerank score. The function returns the top n
-    results.
+    results. Results of near-duplicate queries are served from the query cache.
 
     Args:
          message_content: The content of the user's message.
@@ -56,33 +107,98 @@ async def perform_multi_collection_search(
          collections: A list of collections to search.
          settings: The settings user provided through the UI.
     """
+    # There is nothing to search for in a blank message, skip the embedding
+    # and the vector database round-trips.
+    if not message_content or message_content.isspace() or not collections:
+        return []
+
     embedding = await generate_embedding(message_content, embeddings_model_name)
     if embedding is None:
         return []
 
-    all_results = []
-    for collection in collections:
-        results = vector_store.search(
-            embedding, similarity_threshold, collection
+    enable_rerank = settings['enable_rerank']
+    rerank_top_n = settings.get('rerank_top_n', config.rerank_top_n)
+    if not isinstance(rerank_top_n, int):
+        rerank_top_n = config.rerank_top_n
+
+    # Near-duplicate queries with the same search parameters reuse the results
+    # of the previous search. The embedding is normalized once for both the
+    # lookup and the insertion. The vector database still gets the original
+    # list, its client would convert an array back to a list anyway.
+    query_vector = normalize_embedding(embedding)
+    cache_namespace = (
+        embeddings_model_name,
+        similarity_threshold,
+        tuple(collections),
+        enable_rerank,
+        rerank_top_n,
+    )
+    cached_results = query_cache.get(query_vector, cache_namespace)
+    if cached_results is not None:
+        cl.logger.debug("Search served from the query cache %s", query_cache.stats())
+        return cached_results
+
+    # Collections are searched concurrently, the total latency is the latency
+    # of the slowest collection.
+    search_start = time.perf_counter()
+    results_per_collection = await asyncio.gather(*(
+        _search_collection(
+            message_content, embedding, similarity_threshold, collection,
+            enable_rerank,
         )
+        for collection in collections
+    ))
+    cl.logger.debug(
+        "Searched %d collections in %.3f s, query cache %s",
+        len(collections), time.perf_counter() - search_start, query_cache.stats(),
+    )
+    all_results = [
+        r for results in results_per_collection if results is not None
+        for r in results
+    ]
 
-        for r in results:
-            r['collection'] = collection
-            if settings['enable_rerank']:
-                r['rerank_score'] = await get_rerank_score(message_content, r['text'])
-            else:
-                r['rerank_score'] = None
+    # Every result carries the sort key, so it can be fetched without a
+    # fallback.
+    sort_key = 'rerank_score' if enable_rerank else 'score'
+    # Only the top n results are needed, select them without sorting the whole
+    # merged list.
+    top_results = heapq.nlargest(rerank_top_n, all_results, key=itemgetter(sort_key))
+    # Results missing a failed collection are not reused, the next query
+    # searches again.
+    if None not in results_per_collection:
+        query_cache.put(query_vector, top_results, cache_namespace)
+    return top_results
 
-        all_results.extend(results)
 
-    sort_key = 'rerank_score' if settings['enable_rerank'] else 'score'
-    sorted_results = sorted(all_results, key=lambda x: x.get(sort_key, 0), reverse=True)
+def _dedup_searched_urls(search_results, enable_rerank) -> tuple[list[str], str]:
+    """
+    Deduplicate search urls.
 
-    rerank_top_n = settings.get('rerank_top_n', config.rerank_top_n)
-    if not isinstance(rerank_top_n, int):
-        rerank_top_n = config.rerank_top_n
+    Args:
+        search_results: List of search results
+        enable_rerank: Whether to show the rerank score instead of the
+            similarity score.
+
+    Returns:
+        The deduplicated urls and their text representation with scores.
+    """
+    score_key = "score" if not enable_rerank else "rerank_score"
+    seen_urls: set = set()
+    deduped_urls: list = []
+    search_message_lines: list[str] = []
+
+    # Deduplicate jira urls
+    for result in search_results:
+        url = result.get('url')
+        if url in seen_urls:
+            continue
+        seen_urls.add(url)
+        deduped_urls.append(url)
+        search_message_lines.append(
+            f'🔗 {url}, (_Similarity Score_: {format_score(result.get(score_key, 0))})\n'
+        )
 
-    return sorted_results[:rerank_top_n]
+    return deduped_urls, "".join(search_message_lines)
 
 
 def append_searched_urls(search_results, resp, enable_rerank, urls_as_list=False):
@@ -95,17 +211,8 @@ def append_searched_urls(search_results, resp, enable_rerank, urls_as_list=False
         urls_as_list: Whether to return URLs as a list in `resp.urls`
         or as a string in `resp.content`.
     """
-    search_message = ""
-    deduped_urls: list = []
+    deduped_urls, search_message = _dedup_searched_urls(search_results, enable_rerank)
 
-    # Deduplicate jira urls
-    for result in search_results:
-        url = result.get('url')
-        if url not in deduped_urls:
-            score_key = "score" if not enable_rerank else "rerank_score"
-            rerank_score = result.get(score_key, 0)
-            search_message += f'🔗 {url}, (_Similarity Score_: {rerank_score})\n'
-            deduped_urls.append(url)
     if urls_as_list and deduped_urls:
         if hasattr(resp, 'urls'):
             resp.urls = deduped_urls
@@ -113,6 +220,44 @@ def append_searched_urls(search_results, resp, enable_rerank, urls_as_list=False
         resp.content += "\n\nTop related knowledge:\n" + search_message
 
 
+async def send_searched_urls(search_results, enable_rerank) -> None:
+    """
+    Send search urls as a standalone message.
+
+    Args:
+        search_results: List of search results
+        enable_rerank: Whether to show the rerank score instead of the
+            similarity score.
+    """
+    _, search_message = _dedup_searched_urls(search_results, enable_rerank)
+    if search_message:
+        await cl.Message(content="Top related knowledge:\n" + search_message).send()
+
+
+async def get_num_tokens_cached(content: str, model: str) -> int:
+    """Get the number of tokens in the content, reusing previous counts.
+
+    The same content is tokenized repeatedly within a single turn (length
+    check, debug output), so counts are kept in a small LRU cache keyed by
+    the model and the hash of the content.
+
+    Args:
+        content: The text for which to calculate the token count.
+        model: The model to use for tokenization.
+    """
+    key = (model, hash(content))
+    num_tokens = _num_tokens_cache.get(key)
+    if num_tokens is not None:
+        _num_tokens_cache.move_to_end(key)
+        return num_tokens
+
+    num_tokens = await get_num_tokens(content, model)
+    _num_tokens_cache[key] = num_tokens
+    if len(_num_tokens_cache) > NUM_TOKENS_CACHE_SIZE:
+        _num_tokens_cache.popitem(last=False)
+    return num_tokens
+
+
 def update_msg_count():
     """Update the number of messages in the conversation."""
     counter = cl.user_session.get("counter", 0)
@@ -133,37 +278,47 @@ async def check_message_length(message_content: str) -> tuple[bool, str]:
         - str: Error message if the length check fails, empty string otherwise
     """
     try:
-        num_required_tokens = await get_num_tokens(message_content,
-                                                   await get_embeddings_model_name())
+        num_required_tokens = await get_num_tokens_cached(
+            message_content, await get_embeddings_model_name())
     except httpx.HTTPStatusError as e:
         cl.logger.error(e)
         return False, "We've encountered an issue. Please try again later ..."
 
     if num_required_tokens > config.embeddings_llm_max_context:
-        # On average, a single token corresponds to approximately 4 characters.
-        # Because logs often require more tokens to process, we estimate 3
-        # characters per token.
-        approx_max_chars = round(
-            config.embeddings_llm_max_context * 3, -2)
-
-        error_message = (
-            "⚠️ **Your input is too lengthy!**\n We can process inputs of up "
-            f"to approximately {approx_max_chars} characters. The exact limit "
-            "may vary depending on the input type. For instance, plain text "
-            "inputs can be longer compared to logs or structured data "
-            "containing special characters (e.g., `[`, `]`, `:`, etc.).\n\n"
-            "To proceed, please:\n"
-            "  - Focus on including only the most relevant details, and\n"
-            "  - Shorten your input if possible."
-            " \n\n"
-            "To let you continue, we will reset the conversation history.\n"
-            "Please start over with a shorter input."
-        )
-        return False, error_message
+        return False, _get_input_too_long_message()
 
     return True, ""
 
 
+def _get_input_too_long_message() -> str:
+    """Get the error message for inputs that exceed the token limit."""
+    # On average, a single token corresponds to approximately 4 characters.
+    # Because logs often require more tokens to process, we estimate 3
+    # characters per token.
+    approx_max_chars = round(
+        config.embeddings_llm_max_context * 3, -2)
+
+    return (
+        "⚠️ **Your input is too lengthy!**\n We can process inputs of up "
+        f"to approximately {approx_max_chars} characters. The exact limit "
+        "may vary depending on the input type. For instance, plain text "
+        "inputs can be longer compared to logs or structured data "
+        "containing special characters (e.g., `[`, `]`, `:`, etc.).\n\n"
+        "To proceed, please:\n"
+        "  - Focus on including only the most relevant details, and\n"
+        "  - Shorten your input if possible."
+        " \n\n"
+        "To let you continue, we will reset the conversation history.\n"
+        "Please start over with a shorter input."
+    )
+
+
+def _read_text_file(path: str) -> str:
+    """Read the whole content of a text file."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
 async def print_debug_content(
         settings: dict,
         search_content: str,
@@ -178,15 +333,14 @@ async def print_debug_content(
         message_content: The content of the user's message.
     """
     # Initialize debug_content with all settings
-    debug_content = ""
+    debug_parts: list[str] = []
     if settings:
-        debug_content = "#### Current Settings:\n"
-        for key, value in settings.items():
-            debug_content += f"- {key}: {value}\n"
-    debug_content += "\n\n"
+        debug_parts.append("#### Current Settings:\n")
+        debug_parts.extend(f"- {key}: {value}\n" for key, value in settings.items())
+    debug_parts.append("\n\n")
 
     # Display the search content
-    debug_content += (
+    debug_parts.append(
         f"#### Search Content:\n"
         f"```\n"
         f"{search_content}\n"
@@ -194,19 +348,19 @@ async def print_debug_content(
     )
 
     # Display the number of tokens in the search content
-    num_t = await get_num_tokens(search_content,
-                                 await get_embeddings_model_name())
-    debug_content += f"**Number of tokens in search content:** {num_t}\n\n"
+    num_t = await get_num_tokens_cached(search_content,
+                                        await get_embeddings_model_name())
+    debug_parts.append(f"**Number of tokens in search content:** {num_t}\n\n")
 
     # Display vector DB debug information if debug mode is enabled
     if search_results:
-        debug_content += "#### Vector DB Search Results:\n"
+        debug_parts.append("#### Vector DB Search Results:\n")
+        score_key = "score" if not settings.get("enable_rerank") else "rerank_score"
         for i, result in enumerate(search_results, 1):
-            score_key = "score" if not settings.get("enable_rerank") else "rerank_score"
-            debug_content += (
+            debug_parts.append(
                 f"**Result {i}**\n"
-                f"- Cosine similarity: {result.get('score', 0)}\n"
-                f"- Rerank score: {result.get(score_key, 0)}\n"
+                f"- Cosine similarity: {format_score(result.get('score', 0))}\n"
+                f"- Rerank score: {format_score(result.get(score_key, 0))}\n"
                 f"- URL: {result.get('url', 'N/A')}\n\n"
                 f"Preview:\n"
                 f"```\n"
@@ -214,7 +368,8 @@ async def print_debug_content(
                 f"```\n\n"
             )
     # Escaping markdown
-    debug_content += f"\n#### Full user message:\n```\n{str(message_content)}\n```"
+    debug_parts.append(f"\n#### Full user message:\n```\n{str(message_content)}\n```")
+    debug_content = "".join(debug_parts)
 
     cl.logger.debug(debug_content)
     async with cl.Step(name="debug") as debug_step:
@@ -223,12 +378,63 @@ async def print_debug_content(
 
 def _build_search_content_from_history(message_history: ThreadMessages) -> str:
     """Build string representation of messages from the history."""
-    previous_message_content = ""
-    if message_history:
-        for message in message_history:
-            if message['role'] == 'user':
-                previous_message_content += f"\n{message['content']}"
-    return previous_message_content
+    if not message_history:
+        return ""
+    return "".join(
+        f"\n{message['content']}" for message in message_history
+        if message['role'] == 'user'
+    )
+
+
+async def _discard_task(task: asyncio.Task | None) -> None:
+    """Cancel a task whose result is no longer needed and wait for it.
+
+    Waiting for the task retrieves its exception, if any, so it isn't
+    reported as never retrieved.
+    """
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def _send_message_after(task: asyncio.Task, content: str) -> None:
+    """Send a message once the task finished sending its message.
+
+    This keeps the order of the messages sent from concurrent tasks.
+    """
+    await task
+    await cl.Message(content=content).send()
+
+
+async def _check_message(
+    message_content: str,
+    collections: list[str],
+    search_task: asyncio.Task | None,
+) -> tuple[tuple[bool, str], str]:
+    """Check the message length and the collections.
+
+    Both checks wait on remote servers, so they run concurrently. The search
+    started before the checks is discarded when a check fails or raises.
+
+    Args:
+        message_content: The content checked by check_message_length.
+        collections: The collections checked by check_collections.
+        search_task: The search of the message, if any.
+
+    Returns:
+        The results of check_message_length and check_collections.
+    """
+    checks_passed = False
+    try:
+        length_check, collections_error = await asyncio.gather(
+            check_message_length(message_content),
+            check_collections(collections),
+        )
+        checks_passed = length_check[0] and not collections_error
+        return length_check, collections_error
+    finally:
+        if not checks_passed:
+            await _discard_task(search_task)
 
 
 async def handle_user_message( # pylint: disable=too-many-locals,too-many-statements
@@ -248,8 +454,21 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
 
     try:
         if message.elements and message.elements[0].path:
-            with open(message.elements[0].path, 'r', encoding='utf-8') as file:
-                message.content += TEXT_UPLOAD_TEMPLATE.format(text=file.read())
+            file_path = message.elements[0].path
+            # An approximation of the length check, it skips reading files
+            # that are far too long.
+            if (os.path.getsize(file_path)
+                    > config.embeddings_llm_max_context * MAX_UPLOAD_BYTES_PER_TOKEN):
+                resp.content = _get_input_too_long_message()
+                # Reset message history to let the user try again
+                cl.user_session.set("message_history", [])
+                await resp.send()
+                return
+
+            # Read the file in a worker thread to keep the event loop free
+            file_content = await asyncio.to_thread(_read_text_file, file_path)
+            message.content = message.content + TEXT_UPLOAD_TEMPLATE.format(
+                text=file_content)
     except OSError as e:
         cl.logger.error(e)
         resp.content = "An error occurred while processing your file."
@@ -257,10 +476,23 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
         return
 
     search_content = _build_search_content_from_history(message_history) + message.content
+    chat_profile = cl.user_session.get("chat_profile")
+    collections = get_collections_per_profile(chat_profile)
 
-    # Check message length
-    is_valid_length, error_message = await check_message_length(
-        search_content)
+    # Search the vector database while the length of the message is being
+    # checked. The search is discarded when any of the checks fails.
+    search_task = None
+    if message.content:
+        search_task = asyncio.create_task(perform_multi_collection_search(
+            search_content,
+            await get_embeddings_model_name(),
+            get_similarity_threshold(settings),
+            collections,
+            settings,
+        ))
+
+    (is_valid_length, error_message), collections_error = await _check_message(
+        search_content, collections, search_task)
     if not is_valid_length:
         resp.content = error_message
         # Reset message history to let the user try again
@@ -268,27 +500,17 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
         await resp.send()
         return
 
-    collections = get_collections_per_profile(
-        cl.user_session.get("chat_profile")
-    )
-    error_message = check_collections(collections)
-    if error_message:
-        resp.content = error_message
+    if collections_error:
+        resp.content = collections_error
         await resp.send()
         return
 
-    if message.content:
+    if search_task is not None:
         async with cl.Step(name="searching") as search_step:
             search_step.output = "Searching for relevant information in our knowledge base..."
             # Search all collections with the same embedding (embedding now generated inside)
             try:
-                search_results = await perform_multi_collection_search(
-                    search_content,
-                    await get_embeddings_model_name(),
-                    get_similarity_threshold(),
-                    collections,
-                    settings,
-                )
+                search_results = await search_task
             except httpx.HTTPStatusError as e:
                 cl.logger.error(e)
                 resp.content = "An error occurred while searching the vector database."
@@ -296,20 +518,30 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
                 return
         await search_step.remove()
 
+        # The related knowledge is known before the response is generated,
+        # show it to the user while the response is being generated. It is
+        # shown even if the generation fails, as the search itself succeeded.
+        urls_task = asyncio.create_task(
+            send_searched_urls(search_results, settings.get("enable_rerank", True))
+        )
+        ui_tasks = [urls_task]
+
         async with cl.Step(name="building a prompt") as prompt_step:
             prompt_step.output = "Generating a full prompt on the system prompt, " \
                                  "user message, and search results..."
             is_error_prompt, full_prompt = await build_prompt(
                 search_results,
                 message.content,
-                cl.user_session.get("chat_profile"),
+                chat_profile,
                 HistorySettings(
                     keep_history=settings["keep_history"],
                     message_history=message_history,
                 ),
             )
             if is_error_prompt:
-                await cl.Message(content=constants.WARNING_MESSAGE_TRUNCATED_TEXT).send()
+                # Don't hold back the generation until the warning is sent
+                ui_tasks.append(asyncio.create_task(_send_message_after(
+                    urls_task, constants.WARNING_MESSAGE_TRUNCATED_TEXT)))
         await prompt_step.remove()
 
         if debug_mode:
@@ -318,7 +550,7 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
 
         async with cl.Step(name="thinking and generating a response") as resp_step:
             # Process user message and get AI response
-            is_error = await get_response(
+            await get_response(
                 full_prompt,
                 resp,
                 {
@@ -338,15 +570,13 @@ async def handle_user_message( # pylint: disable=too-many-locals,too-many-statem
             ))
             cl.user_session.set('message_history', full_prompt)
 
-        if not is_error:
-            # Extend response with searched jira urls
-            append_searched_urls(search_results, resp, settings.get("enable_rerank", True))
+        await asyncio.gather(*ui_tasks)
 
     update_msg_count()
     await resp.send()
 
 
-async def handle_user_message_api( # pylint: disable=too-many-arguments
+async def handle_user_message_api( # pylint: disable=too-many-arguments,too-many-locals
     message_content: str,
     similarity_threshold: float,
     generative_model_settings: ModelSettings,
@@ -359,30 +589,33 @@ async def handle_user_message_api( # pylint: disable=too-many-arguments
     """
     response = MockMessage(content="", urls=[])
 
-    # Check message length
-    is_valid_length, error_message = await check_message_length(message_content)
+    collections = get_collections_per_profile(profile_name)
+
+    # Perform search in all collections (embedding generated inside) while
+    # the length of the message is being checked.
+    search_task = asyncio.create_task(perform_multi_collection_search(
+        message_content,
+        embeddings_model_settings["model"],
+        similarity_threshold=similarity_threshold,
+        collections=collections,
+        settings={
+            "enable_rerank": enable_rerank,
+            "rerank_top_n": config.rerank_top_n,
+        },
+    ))
+
+    (is_valid_length, error_message), collections_error = await _check_message(
+        message_content, collections, search_task)
     if not is_valid_length:
         response.content = error_message
         return response
 
-    collections = get_collections_per_profile(profile_name)
-    error_message = check_collections(collections)
-    if error_message:
-        response.content = error_message
+    if collections_error:
+        response.content = collections_error
         return response
 
-    # Perform search in all collections (embedding generated inside)
     try:
-        search_results = await perform_multi_collection_search(
-            message_content,
-            embeddings_model_settings["model"],
-            similarity_threshold=similarity_threshold,
-            collections=collections,
-            settings={
-                "enable_rerank": enable_rerank,
-                "rerank_top_n": config.rerank_top_n,
-            },
-        )
+        search_results = await search_task
     except httpx.HTTPStatusError:
         response.content = "An error occurred while searching the vector database."
         return response
@@ -415,22 +648,23 @@ async def handle_user_message_api( # pylint: disable=too-many-arguments
     return response
 
 
-def get_similarity_threshold() -> float:
+def get_similarity_threshold(settings: dict | None) -> float:
     """
     Get the similarity threshold from user settings or default config.
 
+    Args:
+        settings: The settings user provided through the UI.
+
     Returns:
         Similarity threshold value
     """
-    settings = cl.user_session.get("settings")
+    default_threshold = config.search_similarity_threshold
     if not settings:
-        return config.search_similarity_threshold
-    # Get threshold from settings or fall back to config default
-    threshold = settings.get("search_similarity_threshold",
-                             config.search_similarity_threshold)
+        return default_threshold
 
-    # If threshold is above 1, cap it at 1
-    return min(threshold, 1.0)
+    # Get threshold from settings or fall back to config default. If the
+    # threshold is above 1, cap it at 1.
+    return min(settings.get("search_similarity_threshold", default_threshold), 1.0)
 
 async def get_embeddings_model_name() -> str:
     """Get name of the embeddings model."""
@@ -440,7 +674,7 @@ async def get_embeddings_model_name() -> str:
     except ChainlitContextException:
         return await get_default_embeddings_model_name()
 
-def check_collections(collections_to_check: list[str]) -> str:
+async def check_collections(collections_to_check: list[str]) -> str:
     """
     Verify if the specified collections exist in the vector store.
 
@@ -451,7 +685,7 @@ def check_collections(collections_to_check: list[str]) -> str:
         An error message string listing missing collections, or an empty string
         if all collections exist.
     """
-    available_collections = vector_store.get_collections()
+    available_collections = await get_vector_store().get_collections()
     missing_collections = [
         collection for collection in collections_to_check
         if collection not in available_collections
@@ -1,7 +1,9 @@
 """Configuration settings for the RCA chatbot application."""
 
 from dataclasses import dataclass
+from typing import Any, Callable
 import os
+from urllib.parse import urlparse
 
 from constants import (
     CI_LOGS_SYSTEM_PROMPT,
@@ -13,8 +15,31 @@ from constants import (
 )
 
 
+def _parse_bool(value: str) -> bool:
+    """Parse a boolean environment variable."""
+    return value.lower() == "true"
+
+
+def _get_env(name: str, default: Any, cast: Callable[[str], Any] = str) -> Any:
+    """Get the value of an environment variable converted with cast.
+
+    The default is returned as is when the variable is not set, so it is not
+    converted to a string and parsed back.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return cast(value)
+
+
+def get_tokenize_url(llm_url: str) -> str:
+    """Get the URL of the /tokenize endpoint of the server hosting llm_url."""
+    llm_url_parse = urlparse(llm_url)
+    return f"{llm_url_parse.scheme}://{llm_url_parse.netloc}/tokenize"
+
+
 # pylint: disable=too-many-instance-attributes,too-few-public-methods
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Config:
     """Configuration class for the RCA chatbot."""
     generation_llm_api_url: str
@@ -23,9 +48,12 @@ class Config:
     reranking_model_name: str
     reranking_model_api_key: str
     reranking_model_api_url: str
+    reranking_model_rerank_url: str
     reranking_model_max_context: int
     embeddings_llm_api_url: str
     embeddings_llm_api_key: str
+    embeddings_llm_tokenize_url: str
+    embeddings_llm_tokenizers_dir: str
     embeddings_llm_max_context: int
     generative_model_max_context: int
     default_temperature: float
@@ -36,6 +64,8 @@ class Config:
     vectordb_url: str
     vectordb_api_key: str
     vectordb_port: int
+    vectordb_grpc_port: int
+    vectordb_prefer_grpc: bool
     vectordb_collection_name_jira: str
     vectordb_collection_name_errata: str
     vectordb_collection_name_documentation: str
@@ -45,6 +75,11 @@ class Config:
     search_similarity_threshold: float
     search_top_n: int
     rerank_top_n: int
+    query_cache_max_size: int
+    query_cache_ttl: float
+    query_cache_similarity_threshold: float
+    embeddings_cache_path: str
+    embeddings_cache_max_size: int
     ci_logs_system_prompt: str
     docs_system_prompt: str
     prompt_header: str
@@ -54,80 +89,89 @@ class Config:
     @classmethod
     def from_env(cls) -> 'Config':
         """Create Config instance from environment variables."""
+        reranking_model_api_url = _get_env(
+            "RERANKING_MODEL_API_URL", "http://localhost:8001/v1")
+        embeddings_llm_api_url = _get_env(
+            "EMBEDDINGS_LLM_API_URL", "http://localhost:8000/v1")
+
         return cls(
-            generation_llm_api_url=os.environ.get(
+            generation_llm_api_url=_get_env(
                 "GENERATION_LLM_API_URL", "http://localhost:8000/v1"),
-            generation_llm_api_key=os.environ.get(
-                "GENERATION_LLM_API_KEY", ""),
-            enable_rerank=os.environ.get(
-                "ENABLE_RERANK", "true").lower() == "true",
-            reranking_model_name=os.environ.get(
+            generation_llm_api_key=_get_env("GENERATION_LLM_API_KEY", ""),
+            enable_rerank=_get_env("ENABLE_RERANK", True, _parse_bool),
+            reranking_model_name=_get_env(
                 "RERANKING_MODEL_NAME", "BAAI/bge-reranker-v2-m3"
             ),
-            reranking_model_api_url=os.environ.get(
-                "RERANKING_MODEL_API_URL", "http://localhost:8001/v1"
-            ),
-            reranking_model_api_key=os.environ.get(
-                "RERANKING_MODEL_API_KEY", ""
-            ),
-            reranking_model_max_context=int(os.environ.get(
-                "RERANKING_MODEL_MAX_CONTEXT",
-                8192,
-            )),
-            embeddings_llm_api_url=os.environ.get(
-                "EMBEDDINGS_LLM_API_URL", "http://localhost:8000/v1"),
-            embeddings_llm_api_key=os.environ.get(
-                "EMBEDDINGS_LLM_API_KEY", ""),
-            embeddings_llm_max_context=int(os.environ.get(
-                "EMBEDDINGS_LLM_MAX_CONTEXT",
-                8192,
-            )),
-            generative_model_max_context=int(os.environ.get(
-                "GENERATIVE_MODEL_MAX_CONTEXT",
-                32000,
-            )),
-            default_temperature=float(
-                os.environ.get("DEFAULT_MODEL_TEMPERATURE", 0.7)),
-            default_max_tokens=int(
-                os.environ.get("DEFAULT_MODEL_MAX_TOKENS", 1024)),
-            default_top_p=float(
-                os.environ.get("DEFAULT_MODEL_TOP_P", 1)),
-            default_n=int(os.environ.get("DEFAULT_MODEL_N", 1)),
-            auth_database_url=os.environ.get(
+            reranking_model_api_url=reranking_model_api_url,
+            reranking_model_rerank_url=f"{reranking_model_api_url}/rerank",
+            reranking_model_api_key=_get_env("RERANKING_MODEL_API_KEY", ""),
+            reranking_model_max_context=_get_env(
+                "RERANKING_MODEL_MAX_CONTEXT", 8192, int),
+            embeddings_llm_api_url=embeddings_llm_api_url,
+            embeddings_llm_tokenize_url=get_tokenize_url(embeddings_llm_api_url),
+            embeddings_llm_api_key=_get_env("EMBEDDINGS_LLM_API_KEY", ""),
+            # Directory with <model name>/tokenizer.json files used to count
+            # tokens locally instead of calling the /tokenize endpoint.
+            embeddings_llm_tokenizers_dir=_get_env(
+                "EMBEDDINGS_LLM_TOKENIZERS_DIR", ""),
+            embeddings_llm_max_context=_get_env(
+                "EMBEDDINGS_LLM_MAX_CONTEXT", 8192, int),
+            generative_model_max_context=_get_env(
+                "GENERATIVE_MODEL_MAX_CONTEXT", 32000, int),
+            default_temperature=_get_env("DEFAULT_MODEL_TEMPERATURE", 0.7, float),
+            default_max_tokens=_get_env("DEFAULT_MODEL_MAX_TOKENS", 1024, int),
+            default_top_p=_get_env("DEFAULT_MODEL_TOP_P", 1.0, float),
+            default_n=_get_env("DEFAULT_MODEL_N", 1, int),
+            auth_database_url=_get_env(
                 "AUTH_DATABASE_URL",
                 "postgresql://<username>:<password>@localhost:5432/users"),
-            vectordb_url=os.environ.get(
-                "VECTORDB_URL", "http://localhost:6333"),
-            vectordb_api_key=os.environ.get("VECTORDB_API_KEY", ""),
-            vectordb_port=int(os.environ.get("VECTORDB_PORT", 6333)),
-            vectordb_collection_name_jira=os.environ.get(
+            vectordb_url=_get_env("VECTORDB_URL", "http://localhost:6333"),
+            vectordb_api_key=_get_env("VECTORDB_API_KEY", ""),
+            vectordb_port=_get_env("VECTORDB_PORT", 6333, int),
+            vectordb_grpc_port=_get_env("VECTORDB_GRPC_PORT", 6334, int),
+            vectordb_prefer_grpc=_get_env("VECTORDB_PREFER_GRPC", False, _parse_bool),
+            vectordb_collection_name_jira=_get_env(
                 "VECTORDB_COLLECTION_NAME_JIRA", 'rca-knowledge-base'),
-            vectordb_collection_name_errata=os.environ.get(
+            vectordb_collection_name_errata=_get_env(
                 "VECTORDB_COLLECTION_NAME_ERRATA", 'rca-errata'),
-            vectordb_collection_name_documentation=os.environ.get(
+            vectordb_collection_name_documentation=_get_env(
                 "VECTORDB_COLLECTION_NAME_DOCUMENTATION", 'osp-docs-base'),
-            vectordb_collection_name_ci_logs=os.environ.get(
+            vectordb_collection_name_ci_logs=_get_env(
                 "VECTORDB_COLLECTION_NAME_CI_LOGS", 'rca-ci'),
-            vectordb_collection_name_solutions=os.environ.get(
+            vectordb_collection_name_solutions=_get_env(
                 "VECTORDB_COLLECTION_NAME_SOLUTIONS", 'rca-solutions'),
-            search_instruction=os.environ.get(
-                "SEARCH_INSTRUCTION", SEARCH_INSTRUCTION),
-            search_similarity_threshold=float(
-                os.environ.get("SEARCH_SIMILARITY_THRESHOLD", 0.8)),
-            ci_logs_system_prompt=os.environ.get("CI_LOGS_SYSTEM_PROMPT", CI_LOGS_SYSTEM_PROMPT),
-            docs_system_prompt=os.environ.get("DOCS_SYSTEM_PROMPT", DOCS_SYSTEM_PROMPT),
-            welcome_message=os.environ.get("WELCOME_MESSAGE", WELCOME_MESSAGE),
-            prompt_header=os.environ.get("CONTEXT_HEADER", CONTEXT_HEADER),
-            jira_formatting_syntax_prompt=os.environ.get(
+            search_instruction=_get_env("SEARCH_INSTRUCTION", SEARCH_INSTRUCTION),
+            search_similarity_threshold=_get_env(
+                "SEARCH_SIMILARITY_THRESHOLD", 0.8, float),
+            ci_logs_system_prompt=_get_env("CI_LOGS_SYSTEM_PROMPT", CI_LOGS_SYSTEM_PROMPT),
+            docs_system_prompt=_get_env("DOCS_SYSTEM_PROMPT", DOCS_SYSTEM_PROMPT),
+            welcome_message=_get_env("WELCOME_MESSAGE", WELCOME_MESSAGE),
+            prompt_header=_get_env("CONTEXT_HEADER", CONTEXT_HEADER),
+            jira_formatting_syntax_prompt=_get_env(
                 "JIRA_FORMATTING_SYNTAX", JIRA_FORMATTING_SYNTAX),
 
             # The maximum number of points we can retrieve from a single vector
             # database collection.
-            search_top_n=int(os.environ.get("SEARCH_TOP_N", 10)),
+            search_top_n=_get_env("SEARCH_TOP_N", 10, int),
 
             # The maximum number of points we pass to the generative model after
             # reranking.
-            rerank_top_n=int(os.environ.get("RERANK_TOP_N", 5)),
+            rerank_top_n=_get_env("RERANK_TOP_N", 5, int),
+
+            # The maximum number of searches kept in the semantic query cache
+            # (0 disables the cache), how long they stay valid in seconds, and
+            # the cosine similarity a new query needs to reuse cached results.
+            query_cache_max_size=_get_env("QUERY_CACHE_MAX_SIZE", 2000, int),
+            query_cache_ttl=_get_env("QUERY_CACHE_TTL", 600.0, float),
+            query_cache_similarity_threshold=_get_env(
+                "QUERY_CACHE_SIMILARITY_THRESHOLD", 0.97, float),
+
+            # Path of the SQLite database keeping embeddings across restarts
+            # (empty disables the cache) and the maximum number of embeddings
+            # stored in it.
+            embeddings_cache_path=_get_env("EMBEDDINGS_CACHE_PATH", ""),
+            embeddings_cache_max_size=_get_env(
+                "EMBEDDINGS_CACHE_MAX_SIZE", 100000, int),
         )
 
 
@@ -1,39 +1,159 @@
 """Embedding generation and vector search functionality."""
 
+import asyncio
+from collections import OrderedDict
+from functools import lru_cache
+import os
+import time
 from typing import List
-from urllib.parse import urlparse
 
 import chainlit as cl
 import httpx
 from openai import AsyncOpenAI, OpenAIError
 
+from batching import RequestBatcher
 from config import config
-from generation import extract_model_ids
+from embeddings_cache import embeddings_disk_cache, hash_text
+from generation import MODELS_CACHE_TTL, extract_model_ids, llm_http_client
 
 # Initialize embedding LLM client
 emb_llm = AsyncOpenAI(
     base_url=config.embeddings_llm_api_url,
     organization="",
     api_key=config.embeddings_llm_api_key,
+    http_client=llm_http_client,
 )
 
+# The maximum size of a chunk of search content sent to the re-rank model. We
+# use half of the reranking_model_max_context because we have to leave space
+# for the user's input.
+RERANK_MAX_CHUNK_SIZE = config.reranking_model_max_context // 2
+
+# The /tokenize and /rerank requests go to the same model servers as the LLM
+# clients and share their connection pool (llm_http_client). The pool defaults
+# to the long timeouts of the OpenAI client, these requests keep the httpx
+# default.
+MODEL_SERVER_TIMEOUT = httpx.Timeout(5.0)
+
+
+@lru_cache(maxsize=8)
+def _get_headers(api_key: str) -> dict[str, str]:
+    """Get the headers of a JSON request authenticated with the API key.
+
+    The API keys are fixed for the lifetime of the process, so the headers are
+    built once per key. The returned dict must not be modified.
+    """
+    return {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+
+
+async def close_http_client() -> None:
+    """Close the HTTP client used for requests to the model servers."""
+    await llm_http_client.aclose()
+
+
+# The available embedding models, reused for MODELS_CACHE_TTL seconds.
+_models_cache: tuple[float, List[str], frozenset[str]] | None = None
+_models_cache_lock = asyncio.Lock()
+
+
+async def _get_embeddings_models() -> tuple[List[str], frozenset[str]]:
+    """Get the available embedding models as a list and as a set.
+
+    The list of models rarely changes, so it is cached for MODELS_CACHE_TTL
+    seconds. Concurrent callers wait for a single refresh of the list.
+    """
+    global _models_cache  # pylint: disable=global-statement
+    async with _models_cache_lock:
+        if (_models_cache is not None
+                and time.monotonic() - _models_cache[0] < MODELS_CACHE_TTL):
+            return _models_cache[1], _models_cache[2]
+
+        models = await emb_llm.models.list()
+        model_ids = extract_model_ids(models)
+        model_ids_set = frozenset(model_ids)
+        if model_ids:
+            _models_cache = (time.monotonic(), model_ids, model_ids_set)
+        return model_ids, model_ids_set
+
+
 async def discover_embeddings_model_names() -> List[str]:
     """Discover available embedding LLM models."""
-    models = await emb_llm.models.list()
-    return extract_model_ids(models)
+    model_ids, _ = await _get_embeddings_models()
+    return list(model_ids)
+
+
+async def is_known_embeddings_model(model_name: str) -> bool:
+    """Check whether the embedding LLM model is available."""
+    _, model_ids_set = await _get_embeddings_models()
+    return model_name in model_ids_set
+
 
 async def get_default_embeddings_model_name() -> str:
     """Get name of the default embeddings model."""
     models = await discover_embeddings_model_names()
     return models[0]
 
+
+# The maximum number of embeddings kept by generate_embedding.
+EMBEDDINGS_CACHE_SIZE = 1024
+_embeddings_cache: OrderedDict[tuple[str, bytes], List[float]] = OrderedDict()
+
+
+def _get_embeddings_cache_key(text: str) -> bytes:
+    """Get the key under which the embedding of the text is cached.
+
+    Texts differing only in case, whitespace or trailing punctuation share
+    the cache entry, as their embeddings are nearly identical. The key is a
+    short hash, the texts include the history and uploaded files.
+    """
+    return hash_text(" ".join(text.lower().split()).rstrip(".!?,;:"))
+
+
 async def generate_embedding(
     text: str, model_name: str
 ) -> None | List[float]:
-    """Generate embeddings for the given text using the specified model."""
+    """Generate embeddings for the given text using the specified model.
+
+    Repeated queries (retries, regenerated answers) are common, so embeddings
+    are kept in an LRU cache keyed by the model and a hash of the normalized
+    text, and optionally in the persistent embeddings_disk_cache. The
+    returned list must not be modified.
+    """
+    text_hash = _get_embeddings_cache_key(text)
+    key = (model_name, text_hash)
+    embedding = _embeddings_cache.get(key)
+    if embedding is not None:
+        _embeddings_cache.move_to_end(key)
+        return embedding
+
+    if embeddings_disk_cache.enabled:
+        embedding = await asyncio.to_thread(
+            embeddings_disk_cache.get, text_hash, model_name)
+        if embedding is None:
+            embedding = await embedding_batcher.embed(text, model_name)
+            if embedding is not None:
+                await asyncio.to_thread(
+                    embeddings_disk_cache.put, text_hash, model_name, embedding)
+    else:
+        embedding = await embedding_batcher.embed(text, model_name)
+
+    if embedding is not None:
+        _embeddings_cache[key] = embedding
+        if len(_embeddings_cache) > EMBEDDINGS_CACHE_SIZE:
+            _embeddings_cache.popitem(last=False)
+    return embedding
+
+
+async def _create_embeddings(
+    texts: List[str], model_name: str
+) -> None | List[List[float]]:
+    """Request embeddings for the given texts from the embedding LLM."""
     try:
+        # Without an explicit encoding_format the client requests base64
+        # encoded embeddings, about 4x smaller than JSON floats, and decodes
+        # them locally.
         embedding_response = await emb_llm.embeddings.create(
-            model=model_name, input=text, encoding_format="float"
+            model=model_name, input=texts,
         )
 
         if not embedding_response:
@@ -41,67 +161,160 @@ async def generate_embedding(
                 "Failed to get embeddings: " + "No response from model %s", model_name
             )
             return None
-        if not embedding_response.data or len(embedding_response.data) == 0:
+        if not embedding_response.data or len(embedding_response.data) != len(texts):
             cl.logger.error(
                 "Failed to get embeddings: " + "Empty response for model %s", model_name
             )
             return None
 
-        return embedding_response.data[0].embedding
+        data = sorted(embedding_response.data, key=lambda d: d.index)
+        return [d.embedding for d in data]
     except OpenAIError as e:
-        cl.logger.error("Error generating embeddings: %s", str(e))
+        cl.logger.error("Error generating embeddings: %s", e)
         return None
 
 
+# The maximum number of texts sent to the embedding LLM in a single request.
+EMBEDDINGS_MAX_BATCH_SIZE = 32
+# The maximum number of concurrent requests to the embedding LLM per model.
+EMBEDDINGS_MAX_CONCURRENT_BATCHES = 4
+# The maximum number of characters sent to the embedding LLM in a single
+# request, about one context of the model at ~4 characters per token. Texts
+# near the context size are sent alone, so one of them being rejected doesn't
+# fail (and retry) a batch of other texts.
+EMBEDDINGS_MAX_BATCH_CHARS = config.embeddings_llm_max_context * 4
+
+
+class EmbeddingBatcher(RequestBatcher):
+    """Coalesce concurrent embedding requests into batched requests per model."""
+
+    async def embed(self, text: str, model_name: str) -> None | List[float]:
+        """Generate embeddings for the text as part of a batched request."""
+        return await self.submit(model_name, text)
+
+    @staticmethod
+    def _item_cost(item: str) -> float:
+        """Get the number of characters of the text."""
+        return len(item)
+
+    async def _send_batch(
+        self, key: str, items: List[str]
+    ) -> List[None | List[float]]:
+        """Request the embeddings of the texts of a batch.
+
+        A batch mixes the texts of unrelated sessions and a single rejected
+        text (e.g., one longer than the context of the model) fails the whole
+        request, so a failed batch is retried one text at a time. Only the
+        texts that fail on their own get no embedding.
+        """
+        embeddings = await _create_embeddings(items, key)
+        if embeddings is not None:
+            return embeddings
+        if len(items) == 1:
+            return [None]
+
+        results = await asyncio.gather(*(
+            _create_embeddings([text], key) for text in items
+        ))
+        return [None if result is None else result[0] for result in results]
+
+
+# Create singleton instance
+embedding_batcher = EmbeddingBatcher(
+    max_batch_size=EMBEDDINGS_MAX_BATCH_SIZE,
+    max_concurrent_batches=EMBEDDINGS_MAX_CONCURRENT_BATCHES,
+    max_batch_cost=EMBEDDINGS_MAX_BATCH_CHARS,
+)
+
+
+@lru_cache(maxsize=8)
+def _get_local_tokenizer(model: str):
+    """Load the local tokenizer of the model.
+
+    The tokenizer is read from <EMBEDDINGS_LLM_TOKENIZERS_DIR>/<model>/tokenizer.json.
+
+    Returns:
+        The tokenizers.Tokenizer of the model or None if it is not available.
+    """
+    path = os.path.join(config.embeddings_llm_tokenizers_dir, model, "tokenizer.json")
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        # pylint: disable=import-outside-toplevel
+        from tokenizers import Tokenizer
+        return Tokenizer.from_file(path)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        cl.logger.warning("Failed to load tokenizer %s: %s", path, e)
+        return None
+
+
+def _get_num_tokens_locally(prompt: str, model: str) -> int | None:
+    """Count the tokens of the prompt with the local tokenizer of the model.
+
+    Returns:
+        The number of tokens or None if there is no local tokenizer.
+    """
+    tokenizer = _get_local_tokenizer(model)
+    if tokenizer is None:
+        return None
+    return len(tokenizer.encode(prompt))
+
+
 async def get_num_tokens(
     prompt: str,
     model: str,
-    llm_url: str = config.embeddings_llm_api_url,
-    api_key: str = config.embeddings_llm_api_key,
+    tokenize_url: str | None = None,
+    api_key: str | None = None,
 ) -> int:
     """Retrieve the number of tokens required to process the prompt.
 
     This function calls the /tokenize API endpoint to get the number of
     tokens the input will be transformed into when processed by the specified
-    model (default is the embedding model).
+    model (default is the embedding model). When the default endpoint is used
+    and a local tokenizer of the model is available, the tokens are counted
+    locally without calling the endpoint.
 
     Args:
         prompt: The input text for which to calculate the token count.
         model: The model to use for tokenization.
-        llm_url: The URL of the model.
-        api_key: The API key used for authentication.
+        tokenize_url: The URL of the /tokenize endpoint of the model server
+            (default is the endpoint of the embedding model server).
+        api_key: The API key used for authentication (default is the API key
+            of the embedding model server).
 
     Raises:
         HTTPStatusError: If the response from the /tokenize API endpoint is
-            not 200 status code.
+            not a success status code.
     """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    if tokenize_url is None:
+        if config.embeddings_llm_tokenizers_dir:
+            num_tokens = await asyncio.to_thread(
+                _get_num_tokens_locally, prompt, model)
+            if num_tokens is not None:
+                return num_tokens
+        tokenize_url = config.embeddings_llm_tokenize_url
+    if api_key is None:
+        api_key = config.embeddings_llm_api_key
 
     data = {
         "model": model,
         "prompt": prompt,
     }
 
-    llm_url_parse = urlparse(llm_url)
-    tokenize_url = f"{llm_url_parse.scheme}://{llm_url_parse.netloc}/tokenize"
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(tokenize_url, headers=headers, json=data)
-
-        if response.status_code == 200:
-            response_data = response.json()
-            return response_data["count"]
-
-        response.raise_for_status()
+    response = await llm_http_client.post(
+        tokenize_url, headers=_get_headers(api_key), json=data,
+        timeout=MODEL_SERVER_TIMEOUT)
+    response.raise_for_status()
 
-    return 0
+    return response.json()["count"]
 
 async def get_rerank_score(
         prompt: str,
         search_content: str,
-        model: str = config.reranking_model_name,
-        reranking_model_url: str = config.reranking_model_api_url,
-        reranking_model_api_key: str = config.reranking_model_api_key,
+        model: str | None = None,
+        rerank_url: str | None = None,
+        reranking_model_api_key: str | None = None,
 ) -> float:
     """Contact a re-rank model and get a more precise score for the search content.
 
@@ -114,28 +327,33 @@ async def get_rerank_score(
     Args:
         prompt: User's prompt that the search content should be related to.
         search_content: Is a chunk retrieved from the vector database.
-        model: Name of the model to use for re-ranking.
-        reranking_model_url: URL of the re-rank model.
-        reranking_model_api_key: API key for the re-rank model.
+        model: Name of the model to use for re-ranking (default is set in
+            config.py).
+        rerank_url: URL of the /rerank endpoint of the re-rank model (default
+            is set in config.py).
+        reranking_model_api_key: API key for the re-rank model (default is set
+            in config.py).
 
     Raises:
         HTTPStatusError: If the response from the /score API endpoint is
-            not 200 status code.
+            not a success status code.
     """
+    if model is None:
+        model = config.reranking_model_name
+    if rerank_url is None:
+        rerank_url = config.reranking_model_rerank_url
+    if reranking_model_api_key is None:
+        reranking_model_api_key = config.reranking_model_api_key
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {reranking_model_api_key}"
-    }
-
-    # If the search_content is too big, we have to split it. We use half of the
-    # reranking_model_max_content because we have to leave space for the user's
-    # input.
-    max_chunk_size = config.reranking_model_max_context // 2
-    sub_chunks = [
-        search_content[i:i + max_chunk_size]
-        for i in range(0, len(search_content), max_chunk_size)
-    ]
+    # If the search_content is too big, we have to split it. Most search
+    # results fit into a single chunk.
+    if len(search_content) <= RERANK_MAX_CHUNK_SIZE:
+        sub_chunks = [search_content]
+    else:
+        sub_chunks = [
+            search_content[i:i + RERANK_MAX_CHUNK_SIZE]
+            for i in range(0, len(search_content), RERANK_MAX_CHUNK_SIZE)
+        ]
 
     data = {
         "model": model,
@@ -143,16 +361,12 @@ async def get_rerank_score(
         "documents": sub_chunks,
     }
 
-    rerank_url = f"{reranking_model_url}/rerank"
-    async with httpx.AsyncClient() as client:
-        response = await client.post(rerank_url, headers=headers, json=data)
-
-        if response.status_code == 200:
-            response_data = response.json()
-            if len(response_data["results"]) == 0:
-                return .0
-            return response_data["results"][0].get("relevance_score", .0)
-
-        response.raise_for_status()
+    response = await llm_http_client.post(
+        rerank_url, headers=_get_headers(reranking_model_api_key), json=data,
+        timeout=MODEL_SERVER_TIMEOUT)
+    response.raise_for_status()
 
-    return .0
+    results = response.json()["results"]
+    if not results:
+        return .0
+    return results[0].get("relevance_score", .0)
@@ -0,0 +1,122 @@
+"""Persistent cache of embeddings stored in a SQLite database."""
+
+from hashlib import blake2b
+from typing import List
+import sqlite3
+import threading
+
+# numpy is not a direct dependency, it is installed by qdrant-client.
+import numpy as np
+
+from config import config
+
+
+def hash_text(text: str) -> bytes:
+    """Get the key under which the embedding of the text is cached."""
+    return blake2b(text.encode(), digest_size=16).digest()
+
+
+class EmbeddingsDiskCache:
+    """Thread-safe cache of embeddings that survives restarts.
+
+    Embeddings are stored as float32 blobs keyed by the model name and the
+    hash_text() of the text. When the cache holds more than max_size embeddings, the
+    oldest ones are removed.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        """Initialize the cache, the database is opened on first use.
+
+        Args:
+            path: Path of the SQLite database file. An empty path disables the
+                cache.
+            max_size: The maximum number of cached embeddings.
+        """
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache is configured."""
+        return bool(self.path) and self.max_size > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the table if needed."""
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "hash BLOB NOT NULL, "
+                "embedding BLOB NOT NULL, "
+                "PRIMARY KEY (model, hash))"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(self, text_hash: bytes, model_name: str) -> None | List[float]:
+        """Get the cached embedding of a text.
+
+        Args:
+            text_hash: The hash_text() of the embedded text.
+            model_name: The model the embedding was generated with.
+
+        Returns:
+            The embedding or None on a cache miss.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT embedding FROM embeddings WHERE model = ? AND hash = ?",
+                (model_name, text_hash),
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, text_hash: bytes, model_name: str, embedding: List[float]) -> None:
+        """Store the embedding of a text.
+
+        Args:
+            text_hash: The hash_text() of the embedded text.
+            model_name: The model the embedding was generated with.
+            embedding: The embedding of the text.
+        """
+        if not self.enabled:
+            return
+
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO embeddings (model, hash, embedding) "
+                "VALUES (?, ?, ?)",
+                (model_name, text_hash, blob),
+            )
+            # Rows are inserted with increasing rowids, so the oldest rows
+            # are the ones with the lowest rowids.
+            connection.execute(
+                "DELETE FROM embeddings WHERE rowid <= "
+                "(SELECT MAX(rowid) FROM embeddings) - ?",
+                (self.max_size,),
+            )
+            connection.commit()
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Create singleton instance
+embeddings_disk_cache = EmbeddingsDiskCache(
+    path=config.embeddings_cache_path,
+    max_size=config.embeddings_cache_max_size,
+)
@@ -1,40 +1,83 @@
 """Text generation with large language models."""
 
+import asyncio
+import re
+import time
+
 import chainlit as cl
-from openai import AsyncOpenAI, OpenAIError
+from openai import AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient, OpenAIError
 
 from settings import ModelSettings, ThreadMessages
 from config import config
 from constants import DOCS_PROFILE, RCA_FULL_PROFILE, CI_LOGS_PROFILE
 
+# Connection pool shared by the generative and embedding LLM clients. Both
+# models are often served by the same inference server, so the requests of
+# one client can reuse the open connections of the other.
+llm_http_client = DefaultAsyncHttpxClient()
+
 # Initialize generative LLM client
 gen_llm = AsyncOpenAI(
     base_url=config.generation_llm_api_url,
     organization='',
     api_key=config.generation_llm_api_key,
+    http_client=llm_http_client,
 )
 
 
+# Number of seconds the lists of available models are reused for.
+MODELS_CACHE_TTL = 300
+_models_cache: tuple[float, list[str]] | None = None
+_models_cache_lock = asyncio.Lock()
+
+
 async def discover_generative_model_names() -> list[str]:
-    """Discover available generative LLM models."""
-    models = await gen_llm.models.list()
-    return extract_model_ids(models)
+    """Discover available generative LLM models.
+
+    The list of models rarely changes, so it is cached for MODELS_CACHE_TTL
+    seconds. Concurrent callers wait for a single refresh of the list.
+    """
+    global _models_cache  # pylint: disable=global-statement
+    async with _models_cache_lock:
+        if (_models_cache is None
+                or time.monotonic() - _models_cache[0] >= MODELS_CACHE_TTL):
+            models = await gen_llm.models.list()
+            model_ids = extract_model_ids(models)
+            if not model_ids:
+                return model_ids
+            _models_cache = (time.monotonic(), model_ids)
+        return list(_models_cache[1])
 
 
 def extract_model_ids(models) -> list[str]:
     """Extracts model IDs from the models list."""
-    model_ids = []
-    for model in models.data:
-        model_ids.append(model.id)
+    model_ids = [model.id for model in models.data]
     if not model_ids:
         cl.logger.error("No models available.")
-        return []
     return model_ids
 
 
+# Matches the errors of the OpenAI compatible servers (OpenAI, vLLM, ...) for
+# requests that don't fit into the context of the model.
+_CONTEXT_SIZE_ERROR_RE = re.compile(
+    r"reduce the length of the messages|maximum context length",
+    re.IGNORECASE,
+)
+
+
+def _is_context_size_error(err: OpenAIError) -> bool:
+    """Check whether the request didn't fit into the context of the model.
+
+    Only rejected requests qualify, so that e.g. rate limit errors mentioning
+    tokens don't drop the history.
+    """
+    return (isinstance(err, BadRequestError)
+            and _CONTEXT_SIZE_ERROR_RE.search(err.message) is not None)
+
+
 def _handle_context_size_limit(err: OpenAIError,
                                is_api: bool = False) -> str:
-    if 'reduce the length of the messages or completion' in err.message:
+    if _is_context_size_error(err):
         if not is_api :
             cl.user_session.set('message_history', '')
         return 'Request size with history exceeded limit, ' \
@@ -42,14 +85,57 @@ def _handle_context_size_limit(err: OpenAIError,
     return str(err)
 
 
-async def get_response(user_message: ThreadMessages, # pylint: disable=too-many-arguments
-                       response_msg: cl.Message,
-                       model_settings: ModelSettings,
-                       is_api: bool = False,
-                       stream_response: bool = True,
-                       step: cl.Step = None) -> bool:
+# Streamed tokens are sent to the UI in chunks of up to STREAM_FLUSH_TOKENS
+# tokens, or sooner when STREAM_FLUSH_INTERVAL seconds passed since the last
+# chunk, to avoid a WebSocket message per token.
+STREAM_FLUSH_TOKENS = 8
+STREAM_FLUSH_INTERVAL = 0.02
+
+
+class _StreamBuffer:
+    """Collect streamed tokens and forward them in chunks."""
+
+    def __init__(self, target: cl.Message | cl.Step):
+        """Initialize the buffer.
+
+        Args:
+            target: The message or step the tokens are streamed to.
+        """
+        self._target = target
+        self._tokens: list[str] = []
+        # The first token is sent right away, so that buffering doesn't delay
+        # the start of the response.
+        self._last_flush = float("-inf")
+
+    async def add(self, token: str) -> None:
+        """Add a token, the buffered tokens are sent when the chunk is full."""
+        self._tokens.append(token)
+        if (len(self._tokens) >= STREAM_FLUSH_TOKENS
+                or time.monotonic() - self._last_flush >= STREAM_FLUSH_INTERVAL):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Send the buffered tokens."""
+        if self._tokens:
+            await self._target.stream_token("".join(self._tokens))
+            self._tokens.clear()
+        self._last_flush = time.monotonic()
+
+
+async def get_response( # pylint: disable=too-many-arguments,too-many-locals
+    user_message: ThreadMessages,
+    response_msg: cl.Message,
+    model_settings: ModelSettings,
+    is_api: bool = False,
+    stream_response: bool = True,
+    step: cl.Step = None,
+) -> bool:
     """Send a user's message and generate a response using the LLM.
 
+    If the messages don't fit into the context of the model, the history is
+    dropped from user_message in place, keeping the system prompt and the
+    last message, and the request is sent once more.
+
     Args:
         user_message: The user's input message object.
         response_msg: The message object to populate with the LLM's
@@ -67,20 +153,36 @@ async def get_response(user_message: ThreadMessages, # pylint: disable=too-many-
 
     try:
         if stream_response:
+            content_buffer = _StreamBuffer(response_msg)
+            reasoning_buffer = _StreamBuffer(step) if step else None
+            add_token = content_buffer.add
+            # The end of the reasoning is shown once the answer starts,
+            # instead of after the whole answer was streamed.
+            reasoning_pending = reasoning_buffer is not None
             async for stream_resp in await gen_llm.chat.completions.create(
                 messages=user_message, stream=stream_response,
                 **model_settings
             ):
-                if stream_resp.choices and len(stream_resp.choices) > 0:
-                    delta = stream_resp.choices[0].delta
-
-                    # Stream content to the response message
-                    if token := delta.content or "":
-                        await response_msg.stream_token(token)
-
-                    # Stream reasoning content to the step if it exists
-                    if step and hasattr(delta, "reasoning_content") and delta.reasoning_content:
-                        await step.stream_token(delta.reasoning_content)
+                choices = stream_resp.choices
+                if not choices:
+                    continue
+                delta = choices[0].delta
+
+                # Stream content to the response message
+                if token := delta.content:
+                    if reasoning_pending:
+                        await reasoning_buffer.flush()
+                        reasoning_pending = False
+                    await add_token(token)
+
+                # Stream reasoning content to the step if it exists
+                if reasoning_buffer and (
+                        reasoning := getattr(delta, "reasoning_content", None)):
+                    await reasoning_buffer.add(reasoning)
+
+            await content_buffer.flush()
+            if reasoning_buffer:
+                await reasoning_buffer.flush()
         else:
             response = await gen_llm.chat.completions.create(
                 messages=user_message, stream=stream_response,
@@ -96,6 +198,11 @@ async def get_response(user_message: ThreadMessages, # pylint: disable=too-many-
 
         is_error = False
     except OpenAIError as e:
+        if _is_context_size_error(e) and len(user_message) > 2:
+            del user_message[1:-1]
+            return await get_response(user_message, response_msg, model_settings,
+                                      is_api, stream_response, step)
+
         err_msg = _handle_context_size_limit(e, is_api)
         if not is_api:
             cl.logger.error("Error in process_message_and_get_response: %s",
@@ -106,6 +213,15 @@ async def get_response(user_message: ThreadMessages, # pylint: disable=too-many-
     return is_error
 
 
+# The system prompts are large and constant, build them once instead of
+# concatenating them for every request.
+_SYSTEM_PROMPTS_PER_PROFILE = {
+    DOCS_PROFILE: config.docs_system_prompt,
+    CI_LOGS_PROFILE: config.ci_logs_system_prompt + config.jira_formatting_syntax_prompt,
+    RCA_FULL_PROFILE: config.ci_logs_system_prompt + config.jira_formatting_syntax_prompt,
+}
+
+
 def get_system_prompt_per_profile(profile_name: str) -> str:
     """Get the system prompt for the specified profile.
 
@@ -114,8 +230,4 @@ def get_system_prompt_per_profile(profile_name: str) -> str:
     Returns:
         The system prompt for the specified profile.
     """
-    if profile_name == DOCS_PROFILE:
-        return config.docs_system_prompt
-    if profile_name in [CI_LOGS_PROFILE, RCA_FULL_PROFILE]:
-        return config.ci_logs_system_prompt + config.jira_formatting_syntax_prompt
-    return config.ci_logs_system_prompt
+    return _SYSTEM_PROMPTS_PER_PROFILE.get(profile_name, config.ci_logs_system_prompt)
@@ -1,5 +1,10 @@
 """A module responsible for building the prompt for the generative model."""
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
 from openai.types.chat import (
+    ChatCompletionMessageParam,
     ChatCompletionUserMessageParam,
     ChatCompletionSystemMessageParam,
 )
@@ -11,28 +16,126 @@ from constants import (
 from settings import HistorySettings, ThreadMessages
 from generation import get_system_prompt_per_profile
 
+# Bound formatter for scores, so that they are rendered with a fixed precision
+# instead of going through the default float to str conversion.
+_score_formatter = "{:.4f}".format
+
+
+def format_score(score) -> str:
+    """Format a score with a fixed precision, keep non-numeric values as is."""
+    if isinstance(score, (int, float)):
+        return _score_formatter(score)
+    return str(score)
+
+
+# The template is constant, bind its format method once. Keys rendered by the
+# template are not repeated in the free-form part of the search result.
+_format_search_result = SEARCH_RESULTS_TEMPLATE.format
+_TEMPLATE_KEYS = frozenset(('kind', 'text', 'score', 'components'))
+
+# The maximum number of converted search results kept in memory.
+SEARCH_RESULT_CACHE_SIZE = 256
+
+# The configuration is frozen, so the header of the context section can be
+# built once.
+_NO_RESULTS_PROMPT_PREFIX = config.prompt_header + NO_RESULTS_FOUND + "\n"
+_SEARCH_RESULTS_PROMPT_PREFIX = config.prompt_header + "\n"
+
 
 def search_result_to_str(search_result: dict) -> str:
+    """Convert a search result to a string.
+
+    The same search results are often converted repeatedly (e.g., results of
+    cached searches or follow-up questions), so the conversion is memoized on
+    the content of the search result.
+    """
+    try:
+        return _cached_search_result_to_str(_freeze_search_result(search_result))
+    except TypeError:
+        # The search result contains values that can't be hashed
+        return _search_result_to_str(search_result)
+
+
+def _freeze_search_result(search_result: dict) -> tuple:
+    """Convert a search result to a hashable tuple of its items."""
+    return tuple(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in search_result.items()
+    )
+
+
+@lru_cache(maxsize=SEARCH_RESULT_CACHE_SIZE)
+def _cached_search_result_to_str(search_result_items: tuple) -> str:
+    """Convert a search result frozen by _freeze_search_result to a string."""
+    return _search_result_to_str(dict(search_result_items))
+
+
+def _search_result_to_str(search_result: dict) -> str:
     """Convert a search result to a string."""
-    components = "NO VALUE"
-    if search_result.get('components', []):
-        components = ",".join([str(e) for e in search_result.get('components')])
-
-    search_result_chunk = SEARCH_RESULTS_TEMPLATE.format(
-        kind=search_result.get('kind', "NO VALUE"),
-        text=search_result.get('text', "NO VALUE"),
-        score=search_result.get('score', "NO VALUE"),
+    get = search_result.get
+    components = get('components')
+    components = ",".join(map(str, components)) if components else "NO VALUE"
+
+    # str.join builds a list from its argument anyway, so a list
+    # comprehension is faster than a generator here.
+    extra = "\n".join([
+        f"{k}: {v}" for k, v in search_result.items()
+        if k not in _TEMPLATE_KEYS
+    ])
+
+    return _format_search_result(
+        kind=get('kind', "NO VALUE"),
+        text=get('text', "NO VALUE"),
+        score=format_score(get('score', "NO VALUE")),
         components=components,
-    )
+    ) + extra + "\n---\n"
+
+def _message_len(message: ChatCompletionMessageParam) -> int:
+    """Get the number of characters of the content of a message."""
+    return len(str(message.get('content') or ''))
+
+
+# The message history may take at most this fraction of the prompt, the rest
+# is left for the new search results and the user message.
+HISTORY_MAX_PROMPT_RATIO = 0.5
+# When the history is too long, it is trimmed to this fraction of its maximum
+# length. Dropping more than needed keeps the beginning of the prompt the same
+# for the next several turns, so the inference server can reuse its prefix
+# cache instead of recomputing the whole history on every turn.
+HISTORY_TRIM_RATIO = 0.5
 
-    search_result_chunk += "\n".join(
-        [
-            f"{k}: {v}" for k, v in search_result.items()
-            if k not in ['kind', 'text', 'score', 'components']
-        ])
-    search_result_chunk += "\n---\n"
 
-    return search_result_chunk
+def _trim_message_history(message_history: ThreadMessages,
+                          max_chars: float) -> ThreadMessages:
+    """Drop the oldest messages of the history if it doesn't fit into max_chars.
+
+    The history is trimmed to HISTORY_TRIM_RATIO of max_chars. The system
+    prompt is always kept and the remaining history starts with a user
+    message, so that whole turns are dropped.
+
+    Args:
+        message_history: The messages of the thread, starting with the system
+            prompt.
+        max_chars: The maximum number of characters of the history.
+
+    Returns:
+        The trimmed message history.
+    """
+    system_prompt, turns = message_history[:1], message_history[1:]
+    lengths = [_message_len(message) for message in turns]
+    total_len = sum(lengths) + _message_len(system_prompt[0])
+    if total_len <= max_chars:
+        return message_history
+
+    target_len = max_chars * HISTORY_TRIM_RATIO
+    start = 0
+    while start < len(turns) and (
+            total_len > target_len or turns[start].get('role') != 'user'):
+        total_len -= lengths[start]
+        start += 1
+
+    return system_prompt + turns[start:]
+
 
 # pylint: disable=R0914
 async def build_prompt(
@@ -48,10 +151,12 @@ async def build_prompt(
         2. Text representation of the data retrieved from vector database
         3. User message
 
-    The sections #2 and #2 may repeat if history is enabled. If for whatever
-    reason the full prompt exceeds the maximum context length of the generative
-    model (set in config.py), the new part #2 of the system prompt is truncated.
-    The user message is always appended to the full prompt in its full length.
+    The sections #2 and #2 may repeat if history is enabled. The oldest turns
+    of the history are dropped when the history takes more than
+    HISTORY_MAX_PROMPT_RATIO of the prompt. If for whatever reason the full
+    prompt exceeds the maximum context length of the generative model (set in
+    config.py), the new part #2 of the system prompt is truncated. The user
+    message is always appended to the full prompt in its full length.
 
     Args:
         search_results: A list of results obtained from the vector db
@@ -66,20 +171,9 @@ async def build_prompt(
     """
     # 1. Build system prompt if it is not part of the history already
     is_error = False
-    full_prompt_len = 0
     full_prompt: ThreadMessages = []
     message_history = history_settings.get('message_history', [])
 
-    if not message_history:
-        full_prompt.append(ChatCompletionSystemMessageParam(
-            role="system",
-            content=get_system_prompt_per_profile(profile_name),
-        ))
-    else:
-        full_prompt = message_history
-
-    full_prompt_len += len(str(full_prompt))
-
     # NOTE: On average, a single token corresponds to approximately 4 characters.
     # Because logs often require more tokens to process, we estimate 3
     # characters per token. Also, we do not want to use the full context
@@ -87,44 +181,52 @@ async def build_prompt(
     # to decreased performance (0.75 constant).
     approx_max_chars = config.generative_model_max_context * 3 * 0.75
 
+    if not message_history:
+        full_prompt.append(ChatCompletionSystemMessageParam(
+            role="system",
+            content=get_system_prompt_per_profile(profile_name),
+        ))
+    else:
+        # Keep the history bounded instead of letting it grow until the
+        # generative model rejects the request.
+        full_prompt = _trim_message_history(
+            message_history, approx_max_chars * HISTORY_MAX_PROMPT_RATIO)
+
     # If no information was retrieved from the vector database, end the generation
     # of the prompt.
     if not search_results:
         full_prompt.append(ChatCompletionUserMessageParam(
             role="user",
-            content=config.prompt_header + NO_RESULTS_FOUND + "\n" + user_message,
+            content=_NO_RESULTS_PROMPT_PREFIX + user_message,
         ))
         return is_error, full_prompt
 
 
     # 2. Add search results into the conversations
-    full_user_message = config.prompt_header + "\n"
-    full_prompt_len += len(full_user_message)
-    for res in search_results:
-        search_result_chunk = search_result_to_str(res)
-
-        # If there is not enough space, for search result truncate it and finish
-        # the generation of the prompt.
-        current_prompt_len = (
-            full_prompt_len + len(search_result_chunk) + len(user_message)
-        )
-
-        if current_prompt_len > approx_max_chars:
-            # Calculate how many characters we have to remove from the search
-            # result
-            trim_len = int(current_prompt_len - approx_max_chars)
-            truncated_search_result = SEARCH_RESULT_TRUNCATED_CHUNK.format(
-                text=search_result_chunk[:-trim_len]
-            )
-
-            full_user_message += truncated_search_result
-            full_prompt_len += len(truncated_search_result)
-
-            is_error = True
-            break
+    full_prompt_len = sum(map(_message_len, full_prompt))
+    # The number of characters left for the search results
+    search_results_max_chars = approx_max_chars - (
+        full_prompt_len + len(_SEARCH_RESULTS_PROMPT_PREFIX) + len(user_message)
+    )
 
-        full_user_message += search_result_chunk
-        full_prompt_len += len(search_result_chunk)
+    chunks = [search_result_to_str(res) for res in search_results]
+    chunks_end = list(accumulate(map(len, chunks)))
+    # The number of search results that fit into the prompt in full length
+    num_chunks = bisect_right(chunks_end, search_results_max_chars)
+
+    full_user_message = _SEARCH_RESULTS_PROMPT_PREFIX + "".join(chunks[:num_chunks])
+
+    # If there is not enough space for a search result, truncate it and
+    # leave out the rest of the search results.
+    if num_chunks < len(chunks):
+        search_result_chunk = chunks[num_chunks]
+        # Calculate how many characters we have to remove from the search
+        # result
+        trim_len = int(chunks_end[num_chunks] - search_results_max_chars)
+        full_user_message += SEARCH_RESULT_TRUNCATED_CHUNK.format(
+            text=search_result_chunk[:max(len(search_result_chunk) - trim_len, 0)]
+        )
+        is_error = True
 
     # 3. Add a user's message into the prompt
     full_user_message += "\n" + user_message
@@ -0,0 +1,234 @@
+"""Semantic cache for the results of vector database searches."""
+
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import dataclass
+from typing import List
+import threading
+import time
+
+# numpy is not a direct dependency, it is installed by qdrant-client.
+import numpy as np
+
+from config import config
+
+# The initial number of rows of the embedding matrix of a namespace, it
+# doubles whenever it is full.
+INDEX_INITIAL_ROWS = 16
+
+
+@dataclass(frozen=True)
+class _CacheEntry:
+    """A single cached search.
+
+    Attributes:
+        namespace: Parameters besides the embedding the results depend on.
+        embedding: L2-normalized query embedding.
+        results: Search results obtained for the query embedding.
+        expires_at: Monotonic time after which the entry is stale.
+    """
+    namespace: Hashable
+    embedding: np.ndarray
+    results: list
+    expires_at: float
+
+
+class _NamespaceIndex:
+    """The embeddings of the entries of a namespace, stacked in a matrix.
+
+    Rows are written in place. A removed row is overwritten with the last
+    row, so the first len(keys) rows are the embeddings of the keys.
+    """
+
+    def __init__(self, dimension: int):
+        """Initialize an empty index for embeddings of the dimension."""
+        self.matrix = np.empty((INDEX_INITIAL_ROWS, dimension), dtype=np.float32)
+        self.keys: list[int] = []
+        self._rows: dict[int, int] = {}
+
+    def add(self, key: int, embedding: np.ndarray) -> None:
+        """Add the embedding of an entry."""
+        size = len(self.keys)
+        if size == len(self.matrix):
+            matrix = np.empty((2 * size, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:size] = self.matrix
+            self.matrix = matrix
+        self.matrix[size] = embedding
+        self.keys.append(key)
+        self._rows[key] = size
+
+    def remove(self, key: int) -> None:
+        """Remove the embedding of an entry."""
+        row = self._rows.pop(key)
+        last_key = self.keys.pop()
+        if last_key != key:
+            self.matrix[row] = self.matrix[len(self.keys)]
+            self.keys[row] = last_key
+            self._rows[last_key] = row
+
+    def nearest(self, query: np.ndarray) -> tuple[int, float] | None:
+        """Return the key of the most similar embedding and its similarity."""
+        if not self.keys or query.shape[0] != self.matrix.shape[1]:
+            return None
+        similarities = self.matrix[:len(self.keys)] @ query
+        best = int(np.argmax(similarities))
+        return self.keys[best], float(similarities[best])
+
+
+def normalize_embedding(embedding: List[float]) -> np.ndarray:
+    """Return the L2-normalized embedding as a float32 array."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+# pylint: disable=too-many-instance-attributes
+class QueryCache:
+    """Thread-safe LRU cache of search results keyed by query embeddings.
+
+    A lookup is a hit when the cosine similarity between the query embedding
+    and a cached embedding reaches the similarity threshold, so near-duplicate
+    queries (e.g., whitespace or typo edits) reuse the same results. Entries
+    are only compared within the same namespace, which holds every other
+    parameter the results depend on (collections, thresholds, ...).
+
+    Identical embeddings (retries, repeated questions) are found with a hash
+    lookup before the similarity scan.
+    """
+
+    def __init__(self, max_size: int, ttl: float, similarity_threshold: float):
+        """Initialize the cache.
+
+        Args:
+            max_size: The maximum number of cached searches. Zero disables
+                the cache.
+            ttl: Number of seconds a cached search stays valid.
+            similarity_threshold: Minimum cosine similarity for a cache hit.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.RLock()
+        self._entries: OrderedDict[int, _CacheEntry] = OrderedDict()
+        self._next_key = 0
+        # Keys of the entries by namespace and embedding bytes.
+        self._exact: dict[tuple[Hashable, bytes], int] = {}
+        # Lookup counters, used to tune the size and the threshold.
+        self.hits = 0
+        self.misses = 0
+        # Stacked embeddings per namespace, updated in place.
+        self._index: dict[Hashable, _NamespaceIndex] = {}
+
+    def _remove(self, key: int) -> None:
+        """Remove an entry and its embedding from the index."""
+        entry = self._entries.pop(key)
+        index = self._index[entry.namespace]
+        index.remove(key)
+        if not index.keys:
+            del self._index[entry.namespace]
+        exact_key = (entry.namespace, entry.embedding.tobytes())
+        # A newer entry for the same embedding may have replaced the key.
+        if self._exact.get(exact_key) == key:
+            del self._exact[exact_key]
+
+    def get(self, query: np.ndarray, namespace: Hashable = None) -> list | None:
+        """Return cached results for a similar query embedding, if any.
+
+        Args:
+            query: Query embedding normalized by normalize_embedding.
+            namespace: Parameters besides the embedding the results depend on.
+
+        Returns:
+            A copy of the cached results or None on a cache miss.
+        """
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            results = self._lookup(query, namespace)
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return results
+
+    def _lookup(self, query: np.ndarray, namespace: Hashable) -> list | None:
+        """Return cached results for a similar query embedding, if any."""
+        key = self._exact.get((namespace, query.tobytes()))
+        if key is None:
+            index = self._index.get(namespace)
+            nearest = index.nearest(query) if index is not None else None
+            if nearest is None or nearest[1] < self.similarity_threshold:
+                return None
+            key = nearest[0]
+
+        entry = self._entries[key]
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return list(entry.results)
+
+    def put(self, query: np.ndarray, results: list,
+            namespace: Hashable = None) -> None:
+        """Store search results for the query embedding.
+
+        Args:
+            query: Query embedding normalized by normalize_embedding. It is
+                stored as is and must not be modified afterwards.
+            results: Search results obtained for the query embedding.
+            namespace: Parameters besides the embedding the results depend on.
+        """
+        if self.max_size <= 0:
+            return
+
+        entry = _CacheEntry(
+            namespace=namespace,
+            embedding=query,
+            results=list(results),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            index = self._index.get(namespace)
+            if index is None:
+                index = self._index[namespace] = _NamespaceIndex(query.shape[0])
+            elif index.matrix.shape[1] != query.shape[0]:
+                # Embeddings of another size can't be compared with the
+                # cached ones.
+                return
+            self._entries[self._next_key] = entry
+            self._exact[(namespace, query.tobytes())] = self._next_key
+            index.add(self._next_key, query)
+            self._next_key += 1
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        """Return the number of entries, hits and misses and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        """Remove all cached searches."""
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._exact.clear()
+
+
+# Create singleton instance
+query_cache = QueryCache(
+    max_size=config.query_cache_max_size,
+    ttl=config.query_cache_ttl,
+    similarity_threshold=config.query_cache_similarity_threshold,
+)